@@ -2,15 +2,20 @@
 This module defines the BaseComponent and its subclass Component.
 """
 from collections import Callable
-from inspect import getmembers
 from itertools import chain
 from types import MethodType
+from weakref import WeakKeyDictionary
 
 from .events import Event, registered, unregistered
 from .handlers import HandlerMetaClass, handler
 from .manager import Manager
 
 
+# Per class names of attributes holding handlers or components, along with
+# the sizes of the class dicts along the MRO they were computed from
+_member_names = WeakKeyDictionary()
+
+
 class prepare_unregister(Event):
 
     """
@@ -45,6 +50,10 @@ class prepare_unregister(Event):
             component = component.parent
 
 
+def _is_member(x):
+    return getattr(x, "handler", False) is True or isinstance(x, BaseComponent)
+
+
 class BaseComponent(Manager):
 
     """
@@ -111,7 +120,7 @@ class BaseComponent(Manager):
 
         self.channel = kwargs.get("channel", self.channel) or "*"
 
-        for k, v in getmembers(self):
+        for k, v in self._members():
             if getattr(v, "handler", False) is True:
                 self.addHandler(v)
             # TODO: Document this feature. See Issue #88
@@ -127,6 +136,31 @@ class BaseComponent(Manager):
             self._do_prepare_unregister_complete(event.parent, value)
         self.addHandler(_on_prepare_unregister_complete)
 
+    def _members(self):
+        """
+        Return the (name, value) pairs of this component's attributes that
+        may be handlers or components, sorted by name. The class attributes
+        are only scanned again if an attribute was added to or removed from
+        the class or one of its bases since the last scan.
+        """
+
+        cls = self.__class__
+        signature = tuple(len(k.__dict__) for k in cls.__mro__)
+        cached = _member_names.get(cls)
+        if cached is not None and cached[0] == signature:
+            names = cached[1]
+        else:
+            names = frozenset(
+                k for k in dir(cls) if _is_member(getattr(cls, k, None))
+            )
+            _member_names[cls] = (signature, names)
+
+        names = names.union(
+            k for k, v in self.__dict__.items() if _is_member(v)
+        )
+
+        return [(k, getattr(self, k)) for k in sorted(names)]
+
     def register(self, parent):
         """
         Inserts this component in the component tree as a child
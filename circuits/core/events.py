@@ -18,6 +18,10 @@ class Event(object):
     alert_done = False
     waitingHandlers = 0
 
+    # Completion tracking, see Manager._eventDone()
+    cause = None
+    effects = 0
+
     @classmethod
     def create(cls, _name, *args, **kwargs):
         return type(cls)(_name, (cls,), {})(*args, **kwargs)
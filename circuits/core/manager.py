@@ -2,16 +2,16 @@
 This module defines the Manager class.
 """
 import atexit
-from collections import deque
-from heapq import heappop, heappush
+from bisect import insort
+from collections import defaultdict, deque
+from heapq import heappop, heappush, merge
 from inspect import isfunction
 from itertools import chain, count
 from multiprocessing import Process, current_process
-from operator import attrgetter
 from os import getpid, kill
 from signal import SIGINT, SIGTERM, signal as set_signal_handler
 from sys import exc_info as _exc_info, stderr
-from threading import RLock, Thread, current_thread
+from threading import Thread, current_thread
 from time import time
 from traceback import format_exc
 from types import GeneratorType
@@ -28,6 +28,11 @@ try:
 except ImportError:
     SIGKILL = SIGTERM
 
+try:
+    from fastrlock.rlock import FastRLock as RLock
+except ImportError:
+    from threading import RLock
+
 
 thread = tryimport(("thread", "_thread"))
 
@@ -35,6 +40,10 @@ thread = tryimport(("thread", "_thread"))
 TIMEOUT = 0.1  # 100ms timeout when idle
 
 
+# Registration order of handlers, breaks ties between equal priorities
+_handler_order = count()
+
+
 class UnregistrableError(Exception):
 
     """Raised if a component cannot be registered as child."""
@@ -47,6 +56,8 @@ class TimeoutError(Exception):
 
 class CallValue(object):
 
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -112,6 +123,19 @@ _dummy = Dummy()
 del Dummy
 
 
+def _insort(entries, new_entries):
+    """
+    Insert handler index *new_entries* into the sorted list *entries*.
+    Entries compare as plain tuples, (-priority, order) always decides.
+    """
+
+    if len(new_entries) == 1:
+        insort(entries, new_entries[0])
+    else:
+        entries.extend(new_entries)
+        entries.sort()
+
+
 class _State(object):
 
     __slots__ = ('task', 'run', 'flag', 'event', 'timeout', 'parent', 'task_event', 'tick_handler')
@@ -149,6 +173,12 @@ class _EventQueue(object):
         self._queue.append((priority, next(self._counter), (event, channel)))
 
     def dispatchEvents(self, dispatcher):
+        """
+        Dispatch the events that were queued when the current batch
+        started. They are moved from the deque into the priority heap in
+        place; events fired meanwhile stay queued for the next batch.
+        """
+
         if self._flush_batch == 0:
             # FIXME: Might be faster to use heapify instead of pop +
             # heappush. Though, with regards to thread safety this
@@ -224,16 +254,27 @@ class Manager(object):
 
         self._queue = _EventQueue()
 
-        self._tasks = set()
+        self._tasks = []
         self._cache = dict()
+        self._cache_keys = defaultdict(set)
+        self._channel_intern = dict()
         self._globals = set()
-        self._handlers = dict()
+        self._handlers = defaultdict(set)
+
+        # Flattened (-priority, order, channel, instance, handler, component)
+        # entries of this whole subtree, keyed by event name ("*" for
+        # handlers without names). Every list is kept sorted, highest
+        # priority first. See addHandler().
+        self._handler_index = defaultdict(list)
+        self._globals_index = []
 
         self._flush_batch = 0
         self._cache_needs_refresh = False
+        self._cache_stale_names = set()
 
         self._executing_thread = None
-        self._flushing_thread = None
+        self._executing_thread_ident = None
+        self._flushing_thread_ident = None
         self._running = False
         self.__thread = None
         self.__process = None
@@ -241,6 +282,7 @@ class Manager(object):
 
         self.root = self.parent = self
         self.components = set()
+        self._component_classes = defaultdict(int)
 
     def __nonzero__(self):
         "x.__nonzero__() <==> bool(x)"
@@ -275,8 +317,9 @@ class Manager(object):
         Return True if the Component y is registered.
         """
 
-        components = self.components.copy()
-        return y in components or y in [c.__class__ for c in components]
+        if isinstance(y, type):
+            return y in self._component_classes
+        return y in self.components
 
     def __len__(self):
         """x.__len__() <==> len(x)
@@ -359,54 +402,101 @@ class Manager(object):
         return getpid() if self.__process is None else self.__process.pid
 
     def getHandlers(self, event, channel, **kwargs):
-        name = event.name
-        handlers = set()
+        return set(
+            entry[-2] for entry in self._getHandlerEntries(
+                event, channel, **kwargs
+            )
+        )
 
-        _handlers = set()
-        _handlers.update(self._handlers.get("*", []))
-        _handlers.update(self._handlers.get(name, []))
+    def _getHandlerEntries(self, event, channel, **kwargs):
+        entries = []
+
+        if kwargs.get("exclude_globals", False):
+            _globals = ()
+        else:
+            _globals = self._globals_index
 
-        for _handler in _handlers:
-            handler_channel = _handler.channel
+        _entries = merge(
+            self._handler_index.get("*", ()),
+            self._handler_index.get(event.name, ()),
+            _globals
+        )
+
+        for entry in _entries:
+            handler_channel = entry[2]
             if handler_channel is None:
                 # XXX: Why do we care about the event handler's channel?
                 #      This probably costs us performance for what?
                 #      I've not ever had to rely on this in practice...
-                handler_channel = getattr(
-                    getattr(
-                        _handler, "im_self", getattr(
-                            _handler, "__self__", _dummy
-                        )
-                    ),
-                    "channel", None
-                )
+                handler_channel = getattr(entry[3], "channel", None)
 
             if channel == "*" or handler_channel in ("*", channel,) \
-                    or channel is self:
-                handlers.add(_handler)
+                    or channel is entry[5]:
+                entries.append(entry)
 
-        if not kwargs.get("exclude_globals", False):
-            handlers.update(self._globals)
+        return entries
 
-        for c in self.components.copy():
-            handlers.update(c.getHandlers(event, channel, **kwargs))
+    def _lineage(self):
+        """Yield this manager and all of its ancestors up to the root."""
 
-        return handlers
+        manager = self
+        while True:
+            yield manager
+            if manager.parent is manager:
+                break
+            manager = manager.parent
+
+    def _indexHandlers(self, entries, globals_entries=()):
+        for manager in self._lineage():
+            for name, _entries in entries.items():
+                _insort(manager._handler_index[name], _entries)
+            if globals_entries:
+                _insort(manager._globals_index, globals_entries)
+
+    def _unindexHandlers(self, entries, globals_entries=()):
+        # Entries are matched by their trailing (handler, component) pair,
+        # so plain pairs may be given as well.
+        removed = set(
+            e[-2:] for e in chain(chain(*entries.values()), globals_entries)
+        )
+        for manager in self._lineage():
+            index = manager._handler_index
+            for name in entries:
+                index[name] = [e for e in index[name] if e[-2:] not in removed]
+                if not index[name]:
+                    del index[name]
+            if globals_entries:
+                manager._globals_index = [
+                    e for e in manager._globals_index
+                    if e[-2:] not in removed
+                ]
 
     def addHandler(self, f):
         method = create_bound_method(f, self) if isfunction(f) else f
 
         setattr(self, method.__name__, method)
 
+        # The handler's own channel and the instance it is bound to are
+        # resolved once here. The instance's channel is still looked up
+        # when matching as it may be changed after registration.
+        entry = (
+            -method.priority, next(_handler_order), method.channel,
+            getattr(method, "im_self", getattr(method, "__self__", _dummy)),
+            method, self
+        )
+
         if not method.names and method.channel == "*":
-            self._globals.add(method)
-        elif not method.names:
-            self._handlers.setdefault("*", set()).add(method)
+            if method not in self._globals:
+                self._globals.add(method)
+                self._indexHandlers({}, (entry,))
         else:
-            for name in method.names:
-                self._handlers.setdefault(name, set()).add(method)
+            for name in (method.names or ("*",)):
+                handlers = self._handlers[name]
+                if method not in handlers:
+                    handlers.add(method)
+                    self._indexHandlers({name: [entry]})
 
-        self.root._cache_needs_refresh = True
+        self.root._invalidateCache(method.names or ("*",))
 
         return method
 
@@ -417,8 +507,13 @@ class Manager(object):
             names = [event]
 
         for name in names:
-            self._handlers[name].remove(method)
-            if not self._handlers[name]:
+            # Don't let the defaultdict add an entry for unknown names
+            handlers = self._handlers.get(name)
+            if handlers is None:
+                raise KeyError(name)
+            handlers.remove(method)
+            self._unindexHandlers({name: [(method, self)]})
+            if not handlers:
                 del self._handlers[name]
                 try:
                     delattr(self, method.__name__)
@@ -426,29 +521,78 @@ class Manager(object):
                     # Handler was never part of self
                     pass
 
-        self.root._cache_needs_refresh = True
+        self.root._invalidateCache(names)
+
+    def _invalidateCache(self, names):
+        """
+        Mark the cached handlers of the events with the given *names* as
+        stale. Handlers for all events ("*") affect every cache entry,
+        so they cause a complete refresh.
+
+        The cache itself is only purged by the dispatcher (see
+        :meth:`_refreshCache`) as this may be called from other threads.
+        """
+
+        if "*" in names:
+            self._cache_needs_refresh = True
+        else:
+            self._cache_stale_names.update(names)
+
+    def _refreshCache(self):
+        if self._cache_needs_refresh:
+            # Don't call self._cache.clear() from other threads,
+            # this may interfere with cache rebuild.
+            self._cache_needs_refresh = False
+            self._cache_stale_names.clear()
+            self._cache_keys.clear()
+            self._cache.clear()
+            self._channel_intern.clear()
+            return
+
+        stale = self._cache_stale_names
+        while stale:
+            try:
+                name = stale.pop()
+            except KeyError:
+                break
+            for key in self._cache_keys.pop(name, ()):
+                self._cache.pop(key, None)
 
     def registerChild(self, component):
         if component._executing_thread is not None:
             if self.root._executing_thread is not None:
                 raise UnregistrableError()
             self.root._executing_thread = component._executing_thread
+            self.root._executing_thread_ident = \
+                component._executing_thread_ident
             component._executing_thread = None
-        self.components.add(component)
+            component._executing_thread_ident = None
+        if component not in self.components:
+            self.components.add(component)
+            self._component_classes[component.__class__] += 1
+            self._indexHandlers(
+                component._handler_index, component._globals_index
+            )
         self.root._queue.drainFrom(component._queue)
         self.root._cache_needs_refresh = True
 
     def unregisterChild(self, component):
         self.components.remove(component)
+        classes = self._component_classes
+        classes[component.__class__] -= 1
+        if not classes[component.__class__]:
+            del classes[component.__class__]
+        self._unindexHandlers(
+            component._handler_index, component._globals_index
+        )
         self.root._cache_needs_refresh = True
 
     def _fire(self, event, channel, priority=0):
         # check if event is fired while handling an event
-        th = (self._executing_thread or self._flushing_thread)
-        if thread.get_ident() == (th.ident if th else None) and \
-                not isinstance(event, signal):
+        ident = self._executing_thread_ident or self._flushing_thread_ident
+        if thread.get_ident() == ident and not isinstance(event, signal):
             if self._currently_handling is not None and \
-                    getattr(self._currently_handling, "cause", None):
+                    self._currently_handling.cause is not None:
                 # if the currently handled event wants to track the
                 # events generated by it, do the tracking now
                 event.cause = self._currently_handling
@@ -463,19 +607,20 @@ class Manager(object):
             # If the component is running, we must make sure that
             # any pending generate event waits no longer, as there
             # is something to do now.
-            with self._lock:
-                # Modifications of attribute self._currently_handling
-                # (in _dispatch()), calling reduce_time_left(0). and adding an
-                # event to the (empty) event queue must be atomic, so we have
-                # to lock. We can save the locking around
-                # self._currently_handling = None though, but then need to copy
-                # it to a local variable here before performing a sequence of
-                # operations that assume its value to remain unchanged.
-                handling = self._currently_handling
-
-                self._queue.append(event, channel, priority)
-                if isinstance(handling, generate_events):
-                    handling.reduce_time_left(0)
+            #
+            # Appending to the event queue is atomic (deque.append), so
+            # no lock is needed for that. The event must be queued before
+            # looking at self._currently_handling though: _dispatcher()
+            # sets it and checks the queue length while holding the lock,
+            # so either it sees this event or we see the generate event.
+            # Copy it to a local variable as it may be reset to None
+            # concurrently without locking. reduce_time_left() acquires
+            # the lock itself.
+            self._queue.append(event, channel, priority)
+
+            handling = self._currently_handling
+            if isinstance(handling, generate_events):
+                handling.reduce_time_left(0)
 
     def fireEvent(self, event, *channels, **kwargs):
         """Fire an event into the system.
@@ -493,6 +638,11 @@ class Manager(object):
         if not channels:
             channels = event.channels or (getattr(self, "channel", "*"),) or ("*",)
 
+        # Reuse an equal tuple if there is one, so the dispatcher's cache
+        # lookup succeeds on the identity check instead of comparing items.
+        # Cleared together with the cache, which holds these keys as well.
+        channels = self.root._channel_intern.setdefault(channels, channels)
+
         event.channels = channels
 
         event.value = Value(event, self)
@@ -503,11 +653,14 @@ class Manager(object):
     fire = fireEvent
 
     def registerTask(self, g):
-        self.root._tasks.add(g)
+        root = self.root
+        if g not in root._tasks:
+            root._tasks.append(g)
 
     def unregisterTask(self, g):
-        if g in self.root._tasks:
-            self.root._tasks.remove(g)
+        root = self.root
+        if g in root._tasks:
+            root._tasks.remove(g)
 
     def waitEvent(self, event, *channels, **kwargs):  # noqa
         # XXX: C901: This has a high McCabe complexity score of 16.
@@ -594,12 +747,12 @@ class Manager(object):
     def _flush(self):
         # Handle events currently on queue, but none of the newly generated
         # events. Note that _flush can be called recursively.
-        old_flushing = self._flushing_thread
+        old_flushing = self._flushing_thread_ident
         try:
-            self._flushing_thread = current_thread()
+            self._flushing_thread_ident = thread.get_ident()
             self._queue.dispatchEvents(self._dispatcher)
         finally:
-            self._flushing_thread = old_flushing
+            self._flushing_thread_ident = old_flushing
 
     def flushEvents(self):
         """
@@ -620,29 +773,33 @@ class Manager(object):
             return
 
         if event.complete:
-            if not getattr(event, "cause", None):
+            if event.cause is None:
                 event.cause = event
             event.effects = 1  # event itself counts (must be done)
         eargs = event.args
         ekwargs = event.kwargs
+        generating = isinstance(event, generate_events)
 
-        if self._cache_needs_refresh:
-            # Don't call self._cache.clear() from other threads,
-            # this may interfere with cache rebuild.
-            self._cache.clear()
-            self._cache_needs_refresh = False
+        if self._cache_needs_refresh or self._cache_stale_names:
+            self._refreshCache()
+        key = (event.name, channels)
         try:  # try/except is fastest if successful in most cases
-            event_handlers = self._cache[(event.name, channels)]
+            event_handlers = self._cache[key]
         except KeyError:
-            h = (self.getHandlers(event, channel) for channel in channels)
-
-            event_handlers = sorted(
-                chain(*h),
-                key=attrgetter("priority"),
-                reverse=True
-            )
+            if len(channels) == 1:
+                event_handlers = [
+                    entry[-2] for entry in self._getHandlerEntries(
+                        event, channels[0]
+                    )
+                ]
+            else:
+                h = (
+                    self._getHandlerEntries(event, channel)
+                    for channel in channels
+                )
+                event_handlers = [entry[-2] for entry in merge(*h)]
 
-            if isinstance(event, generate_events):
+            if generating:
                 from .helpers import FallBackGenerator
                 event_handlers.append(FallBackGenerator()._on_generate_events)
             elif isinstance(event, exception) and len(event_handlers) == 0:
@@ -652,14 +809,17 @@ class Manager(object):
                 from .helpers import FallBackSignalHandler
                 event_handlers.append(FallBackSignalHandler()._on_signal)
 
-            self._cache[(event.name, channels)] = event_handlers
+            self._cache[key] = event_handlers
+            self._cache_keys[event.name].add(key)
 
-        if isinstance(event, generate_events):
+        if generating:
             with self._lock:
                 self._currently_handling = event
                 if remaining > 0 or len(self._queue) or not self._running:
                     event.reduce_time_left(0)
                 elif self._tasks:
+                    # Pending tasks are polled every TIMEOUT. With none,
+                    # time_left stays negative and the wait is unbounded.
                     event.reduce_time_left(TIMEOUT)
                 # From now on, firing an event will reduce time left
                 # to 0, which prevents event handlers from waiting (or wakes
@@ -669,6 +829,7 @@ class Manager(object):
 
         value = None
         err = None
+        tasks = self._tasks
 
         for event_handler in event_handlers:
             event.handler = event_handler
@@ -703,7 +864,7 @@ class Manager(object):
 
             # it is kind of a temporal hack to allow processing
             # of tasks, added in one of event handlers here
-            if isinstance(event, generate_events) and self._tasks:
+            if generating and tasks:
                 event.reduce_time_left(TIMEOUT)
 
             if event.stopped:
@@ -731,8 +892,8 @@ class Manager(object):
 
         while True:
             # cause attributes indicates interest in completion event
-            cause = getattr(event, "cause", None)
-            if not cause:
+            cause = event.cause
+            if cause is None:
                 break
             # event takes part in complete detection (as nested or root event)
             event.effects -= 1
@@ -745,8 +906,8 @@ class Manager(object):
                 )
 
             # this event and nested events are done now
-            delattr(event, "cause")
-            delattr(event, "effects")
+            event.cause = None
+            event.effects = 0
             # cause has one of its nested events done, decrement and check
             event = cause
 
@@ -926,7 +1087,7 @@ class Manager(object):
         """
         # process tasks
         if self._tasks:
-            for task in self._tasks.copy():
+            for task in self._tasks[:]:
                 self.processTask(*task)
 
         if self._running:
@@ -962,6 +1123,7 @@ class Manager(object):
 
         self._running = True
         self.root._executing_thread = current_thread()
+        self.root._executing_thread_ident = thread.get_ident()
 
         # Setup Communications Bridge
 
@@ -987,5 +1149,6 @@ class Manager(object):
                 pass
 
         self.root._executing_thread = None
+        self.root._executing_thread_ident = None
         self.__thread = None
         self.__process = None
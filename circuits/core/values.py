@@ -27,19 +27,21 @@ class Value(object):
     This is a Future/Promise implementation.
     """
 
+    # Most values are never looked at (fire and forget), so the initial
+    # state is kept on the class and only set per instance when changed.
+    notify = False
+    promise = False
+
+    result = False
+    errors = False
+    handled = False
+
+    _value = None
+
     def __init__(self, event=None, manager=None):
         self.event = event
         self.manager = manager
-
-        self.notify = False
-        self.promise = False
-
-        self.result = False
-        self.errors = False
         self.parent = self
-        self.handled = False
-
-        self._value = None
 
     def __getstate__(self):
         odict = self.__dict__.copy()
@@ -86,5 +86,8 @@ setup(
     setup_requires=[
         "setuptools_scm"
     ],
-    extras_require={"stomp": ["stompest>=2.3.0", "pysocks>=1.6.7"]},
+    extras_require={
+        "stomp": ["stompest>=2.3.0", "pysocks>=1.6.7"],
+        "fastrlock": ["fastrlock"],
+    },
 )
@@ -1,4 +1,4 @@
-from circuits import Component, Manager
+from circuits import BaseComponent, Component, Event, Manager
 from circuits.core.handlers import handler
 
 
@@ -39,6 +39,14 @@ class C(Base):
     channel = "c"
 
 
+class Counter(Component):
+
+    count = 0
+
+    def hello(self):
+        self.count += 1
+
+
 def test_basic():
     m = Manager()
 
@@ -64,6 +72,8 @@ def test_complex():
     b.register(a)
 
     assert a in m
+    assert A in m
+    assert B not in m
     assert a.root == m
     assert a.parent == m
     assert b in a
@@ -76,6 +86,7 @@ def test_complex():
 
     assert b.informed
     assert a not in m
+    assert A not in m
     assert a.root == a
     assert a.parent == a
     assert b in a
@@ -83,6 +94,70 @@ def test_complex():
     assert b.parent == a
 
 
+def test_handlers_follow_registration():
+    m = Manager()
+
+    a = A()
+    b = B()
+
+    a.register(m)
+    b.register(a)
+
+    e = Event.create("prepare_unregister")
+
+    assert isinstance(m.getHandlers(e, "*"), set)
+    assert b._on_prepare_unregister in m.getHandlers(e, "*")
+    assert b._on_prepare_unregister in a.getHandlers(e, "*")
+
+    a.unregister()
+    while len(m):
+        m.flush()
+
+    assert b._on_prepare_unregister not in m.getHandlers(e, "*")
+    assert b._on_prepare_unregister in a.getHandlers(e, "*")
+
+
+def test_register_twice():
+    m = Manager()
+
+    counter = Counter()
+    counter.register(m)
+    counter.register(m)
+
+    while len(m):
+        m.flush()
+
+    m.fire(Event.create("hello"))
+    while len(m):
+        m.flush()
+
+    assert counter.count == 1
+
+
+def test_late_class_handler():
+    class Late(BaseComponent):
+        pass
+
+    Late()
+
+    @handler("hello")
+    def on_hello(self):
+        return "late"
+
+    Late.on_hello = on_hello
+
+    m = Manager()
+    Late().register(m)
+    while len(m):
+        m.flush()
+
+    x = m.fire(Event.create("hello"))
+    while len(m):
+        m.flush()
+
+    assert x.value == "late"
+
+
 def test_subclassing_with_custom_channel():
     base = Base()
 
@@ -55,3 +55,47 @@ def test_removeHandler():
     assert "foo" not in m._handlers
 
     m.stop()
+
+
+def test_addHandler_keeps_unrelated_cache():
+    m = Manager()
+    m.addHandler(on_foo)
+
+    m.fire(foo())
+    m.flush()
+
+    cached = m._cache[("foo", ("*",))]
+
+    @handler("bar")
+    def on_bar(self):
+        pass
+
+    m.addHandler(on_bar)
+
+    x = m.fire(foo())
+    m.flush()
+
+    assert x.value == "Hello World!"
+    assert m._cache[("foo", ("*",))] is cached
+
+    @handler("foo")
+    def on_foo_again(self):
+        pass
+
+    m.addHandler(on_foo_again)
+
+    m.fire(foo())
+    m.flush()
+
+    assert m._cache[("foo", ("*",))] is not cached
+
+
+def test_removeHandler_unknown_name():
+    m = Manager()
+    method = m.addHandler(on_foo)
+
+    with pytest.raises(KeyError):
+        m.removeHandler(method, "bar")
+
+    assert "bar" not in m._handlers
+    assert method in m._handlers["foo"]
@@ -36,3 +36,31 @@ def test_main():
         m.flush()
     x = list(v)
     assert x == [3, 2, 0]
+
+
+class Child(Component):
+
+    @handler("test", priority=1)
+    def test_1(self):
+        return 1
+
+    @handler("test", priority=4)
+    def test_4(self):
+        return 4
+
+
+def test_subtree():
+    child = Child().register(app)
+    while len(m):
+        m.flush()
+
+    v = m.fire(test(), "*", app.channel)
+    while len(m):
+        m.flush()
+    x = list(v)
+
+    child.unregister()
+    while len(m):
+        m.flush()
+
+    assert x == [4, 4, 3, 3, 2, 2, 1, 1, 0, 0]